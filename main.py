@@ -1,27 +1,64 @@
 import os
 import sys
-import json
 import uuid
-from typing import List, Literal, TypedDict, Optional, Dict
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Annotated, List, Literal, TypedDict, Optional, Dict
 
 from langgraph.graph import StateGraph, START, END
-from langgraph.types import interrupt
-from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.types import Command, interrupt
+from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
 
+import aiosqlite
+import httpx
+import ijson
+import msgspec
+
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 
 # ---------------------------
 # State (so simpel wie möglich)
 # ---------------------------
 
+# Die Nodes lesen nur die letzten 1-2 Wellen – mehr muss nicht in jeden Checkpoint.
+# Das vollständige Log landet in REACTIONS_LOG.
+REACTION_WINDOW = 4
+REACTIONS_LOG = "shitstorm_reactions.jsonl"
+
+
+def _append_window(left: List[str], right: List[str]) -> List[str]:
+    # Reducer: neue Wellen anhängen, nur die letzten REACTION_WINDOW behalten
+    return (left + right)[-REACTION_WINDOW:]
+
+
 class SimState(TypedDict, total=False):
     cause: str                               # Anlass/Ursache
     company_response: Optional[str]          # letzte Unternehmensantwort
-    community_reactions: List[str]           # Log der Kommentar-Wellen (als Textblöcke)
+    community_reactions: Annotated[List[str], _append_window]  # letzte Kommentar-Wellen (Reducer hängt an)
     reputation_score: int                    # 0..100 (Start 50)
     iteration: int                           # Runden-Zähler
     status: Literal["ongoing", "resolved", "catastrophe"]
     last_eval: Dict                          # zuletzt berechnete Bewertung
+    _prev_join_2: str                        # letzte 2 Wellen, fertig verbunden (für die Prompts)
+
+
+class Eval(msgspec.Struct):
+    # Erwartete Form der LLM-Bewertung (Defaults für fehlende Felder)
+    score: int = 50
+    label: Literal["poor", "mixed", "good"] = "mixed"
+    resolved: bool = False
+    catastrophe: bool = False
+    reasons: List[str] = []
+    suggestions: List[str] = []
+
+
+class RoundResult(msgspec.Struct):
+    # Antwort des kombinierten Aufrufs: Bewertung der letzten Antwort + neue Welle
+    eval: Eval
+    comments: List[str] = []
+    partial: bool = False  # nur lokal gesetzt: vorzeitig abgebrochen, reasons/suggestions fehlen
 
 
 # ---------------------------
@@ -30,7 +67,110 @@ class SimState(TypedDict, total=False):
 
 # Du kannst das Modell anpassen. "gpt-4o-mini" hat gutes Kosten/Nutzen.
 MODEL_NAME = os.environ.get("SHITSTORM_MODEL", "gpt-4o-mini")
-llm = ChatOpenAI(model=MODEL_NAME, temperature=0.7)
+
+# Eine Runde (Bewertung + neue Welle) in einem Aufruf mit Structured Output.
+# Reihenfolge ist Absicht: erst die Statusfelder, dann reasons/suggestions, zuletzt die Kommentare.
+EVAL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "score": {"type": "integer"},
+        "label": {"type": "string", "enum": ["poor", "mixed", "good"]},
+        "resolved": {"type": "boolean"},
+        "catastrophe": {"type": "boolean"},
+        "reasons": {"type": "array", "items": {"type": "string"}},
+        "suggestions": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["score", "label", "resolved", "catastrophe", "reasons", "suggestions"],
+    "additionalProperties": False,
+}
+ROUND_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "eval": EVAL_SCHEMA,
+        "comments": {"type": "array", "items": {"type": "string"}, "minItems": 5, "maxItems": 5},
+    },
+    "required": ["eval", "comments"],
+    "additionalProperties": False,
+}
+
+# Ein gemeinsamer HTTP/2-Client mit Keep-Alive für alle LLM-Aufrufe (TLS-Handshake nur einmal).
+# Sein Connection-Pool gehört zum laufenden Event-Loop, daher werden Client und LLMs
+# erst in build_app() erzeugt und in close_app() wieder geschlossen.
+_HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+reaction_llm: Optional[ChatOpenAI] = None
+round_llm: Optional[ChatOpenAI] = None
+
+
+def _open_llms() -> None:
+    global _HTTP_CLIENT, reaction_llm, round_llm
+    _HTTP_CLIENT = httpx.AsyncClient(http2=True, limits=httpx.Limits(max_keepalive_connections=4))
+    reaction_llm = ChatOpenAI(model=MODEL_NAME, temperature=0.7, http_async_client=_HTTP_CLIENT)
+    # Ein Aufruf, eine Temperatur: die Bewertung muss stabil bleiben, daher niedrig wie beim reinen Eval-Aufruf.
+    # Bekannter Trade-off: Wellen ab Runde 2 kommen damit aus 0.2 und sind gleichförmiger als die
+    # aus reaction_llm (0.7: erste Welle, Eval-Cache-Treffer, nicht parsebare Antwort).
+    round_llm = ChatOpenAI(
+        model=MODEL_NAME,
+        temperature=0.2,
+        http_async_client=_HTTP_CLIENT,
+        model_kwargs={
+            "response_format": {
+                "type": "json_schema",
+                "json_schema": {"name": "Round", "strict": True, "schema": ROUND_SCHEMA},
+            }
+        },
+    )
+
+
+# ---------------------------
+# Prompts (statischer Präfix)
+# ---------------------------
+
+# Alles Statische steht vorne (System-Nachricht), alles Dynamische kompakt
+# hinten in der User-Nachricht. So bleibt der Präfix über alle Aufrufe
+# byte-identisch und OpenAIs automatischer Prompt-Cache kann greifen.
+
+_COMMUNITY_RULES = (
+    "Du simulierst die breite Social-Media-Community in einer PR-Krise. "
+    "Erzeuge realistische, kritische, aber nicht diskriminierende Kommentare. "
+    "Vermeide Beleidigungen, Drohungen, Slurs. Keine Ratschläge an das Unternehmen. "
+    "Erzeuge 5 sehr kurze, unterschiedliche Kommentare (1-2 Sätze je). "
+    "Hoher Ärgerlevel: deutlich kritischer/empörter; niedriger: gemischt/abkühlend."
+)
+
+_EVAL_RUBRIC = (
+    "Bewerte die Antwort des Unternehmens auf einer Skala 0-100 (0 sehr schlecht, 100 exzellent) "
+    "nach diesen Kriterien: (1) Verantwortungsübernahme, (2) Empathie, (3) Konkrete Maßnahmen/Abhilfe, "
+    "(4) Transparenz/Klarheit, (5) Ton (nicht defensiv, nicht relativierend). "
+    "Felder: reasons/suggestions als kurze Strings, "
+    "resolved nur wenn die Antwort realistisch beruhigend ist, "
+    "catastrophe nur wenn die Antwort die Lage massiv verschlimmert."
+)
+
+# Nur Kommentare (erste Welle, bzw. wenn die Bewertung aus dem Cache kommt)
+COMMUNITY_SYS_PROMPT = _COMMUNITY_RULES + (
+    " Nummeriert 1.-5. "
+    "Eingabe: cause=Anlass|anger=Ärgerlevel 0-100|last=letzte Unternehmensantwort|"
+    "prev=vorherige Reaktionen ('-' = keine)."
+)
+
+# Bewertung der Antwort + Kommentarwelle darauf in einem Aufruf
+ROUND_SYS_PROMPT = (
+    "Zwei Aufgaben, Antwort als ein JSON. eval: " + _EVAL_RUBRIC + " comments: " + _COMMUNITY_RULES
+    + " Die Kommentare reagieren auf die Unternehmensantwort, ihr Ton folgt deiner Bewertung. "
+    "Eingabe: cause=Anlass|anger=Ärgerlevel vor der Antwort 0-100|"
+    "prev=vorherige Reaktionen ('-' = keine)|reply=zu bewertende Unternehmensantwort."
+)
+
+# Layout der User-Nachrichten: fester Kopf pro Simulation + dynamischer Teil pro Aufruf
+SESSION_HEADER_TMPL = "cause={cause}|"
+COMMUNITY_USER_TMPL = "anger={anger}|last={last}|prev={prev}"
+ROUND_USER_TMPL = "anger={anger}|prev={prev}|reply={reply}"
+
+
+def _session_header(cause: str) -> str:
+    # Die Cause ändert sich innerhalb einer Simulation nie: als fester Kopf jeder User-Nachricht
+    # bleibt System-Prompt + Cause bei jedem Aufruf derselbe Präfix (serverseitiger Prefix-Cache)
+    return SESSION_HEADER_TMPL.format(cause=cause)
 
 
 # ---------------------------
@@ -46,190 +186,335 @@ def _anger_from_rep(rep: int) -> int:
     return _clamp(100 - rep, 0, 100)
 
 
-# ---------------------------------------
-# Node: Community Reaction (mit interrupt)
-# ---------------------------------------
+_LABEL_DELTA = {"good": +20, "mixed": 0, "poor": -20}
 
-def community_reaction_node(state: SimState) -> SimState:
-    cause = state["cause"]
-    rep = state.get("reputation_score", 50)
-    anger = _anger_from_rep(rep)
-    last_company = state.get("company_response")
-    prev = "\n\n---\n".join(state.get("community_reactions", [])[-2:])  # nur wenig Kontext
-
-    # Prompt: erzeugt kurze Social-Media-Kommentare ohne Beleidigungen/Slurs
-    sys_prompt = (
-        "Du simulierst die breite Social-Media-Community in einer PR-Krise. "
-        "Erzeuge realistische, kritische, aber nicht diskriminierende Kommentare. "
-        "Vermeide Beleidigungen, Drohungen, Slurs. Keine Ratschläge an das Unternehmen."
-    )
-    user_prompt = f"""Anlass/Cause: {cause}
 
-Letzte Unternehmensantwort (falls vorhanden):
-{last_company if last_company else "(keine bisher)"}
+def _outcome(rep: int, itr: int, label: str, resolved: bool, catastrophe: bool):
+    # sehr einfache Heuristik um reputation_score zu aktualisieren
+    delta = _LABEL_DELTA[label]  # label ist durch Schema + Eval validiert
+    new_rep = _clamp(rep + delta)
+
+    # Endbedingungen (simpel & transparent)
+    status: Literal["ongoing", "resolved", "catastrophe"] = "ongoing"
+    if resolved or new_rep >= 80:
+        status = "resolved"
+    elif catastrophe or new_rep <= 15 or itr >= 6 and new_rep < 60:
+        status = "catastrophe"
+    return new_rep, status
+
 
-Auszüge vorheriger Reaktionen:
-{prev if prev else "(noch keine)"}
+# -----------------------------------------------
+# Node: Runde (Bewertung + Community-Welle, 1 Call)
+# -----------------------------------------------
 
-Aktueller Ärgerlevel (0-100): {anger}
+def _log_wave(thread_id: Optional[str], comments: str) -> None:
+    # Vollständiges Log als Sidecar-Datei (eine JSON-Zeile pro Welle), nicht im State
+    with open(REACTIONS_LOG, "ab") as f:
+        f.write(msgspec.json.encode({"thread_id": thread_id, "wave": comments}) + b"\n")
 
-Aufgabe:
-- Erzeuge 5 sehr kurze, unterschiedliche Social-Media-Kommentare (1-2 Sätze je).
-- Tonalität: bei hohem Ärgerlevel deutlich kritischer/empörter; bei niedrigem Ärgerlevel gemischt/abkühlend.
-- Formatiere als nummerierte Liste 1.-5.
-- Keine Ratschläge, keine beleidigende Sprache.
-"""
 
-    comments = llm.invoke(
+async def _wave_update(state: SimState, config: RunnableConfig, comments: str) -> SimState:
+    # Datei-I/O nicht auf dem Event-Loop
+    await asyncio.to_thread(_log_wave, config["configurable"].get("thread_id"), comments)
+    return {
+        "community_reactions": [comments],  # nur die neue Welle, LangGraph hängt sie an
+        # Kontext für die nächsten Prompts einmal hier verbinden statt bei jedem Aufruf
+        "_prev_join_2": "\n\n---\n".join(state.get("community_reactions", [])[-1:] + [comments]),
+    }
+
+
+async def _community_wave(header: str, anger: int, last: Optional[str], prev: str) -> str:
+    # Nur die dynamischen Werte – Anweisungen und Cause stecken im festen Präfix
+    user_prompt = header + COMMUNITY_USER_TMPL.format(
+        anger=anger, last=last or "-", prev=prev or "-"
+    )
+    return (await reaction_llm.ainvoke(
         [
-            {"role": "system", "content": sys_prompt},
+            {"role": "system", "content": COMMUNITY_SYS_PROMPT},
             {"role": "user", "content": user_prompt},
         ]
-    ).content.strip()
+    )).content.strip()
 
-    # Log in den State schreiben
-    new_log = list(state.get("community_reactions", []))
-    new_log.append(comments)
 
-    # Jetzt Human-in-the-Loop: nach Unternehmensantwort fragen (interrupt)
-    # Der Wert von interrupt(...) wird beim Resume die User-Antwort enthalten.
-    company_reply = interrupt({
-        "type": "company_response_required",
-        "message": (
-            "Formuliere deine Unternehmensantwort (Tweet/Statement/Posting) "
-            "auf diese Kommentarwelle."
-        ),
-        "community_wave": comments
-    })
+# Pfade der Felder, die den Status bestimmen (stehen im Schema vor allem anderen)
+_EARLY_FIELDS = {
+    "eval.score": "score",
+    "eval.label": "label",
+    "eval.resolved": "resolved",
+    "eval.catastrophe": "catastrophe",
+}
 
-    return {
-        "community_reactions": new_log,
-        "company_response": company_reply
-    }
 
+# Bewertungen identischer (cause, reply)-Paare im Prozess wiederverwenden (LRU, begrenzt)
+_EVAL_CACHE_MAXSIZE = 32
+_EVAL_CACHE: "OrderedDict[bytes, Eval]" = OrderedDict()
 
-# -------------------------
-# Node: Evaluation (Rubrik)
-# -------------------------
 
-def evaluation_node(state: SimState) -> SimState:
-    cause = state["cause"]
-    reply = state.get("company_response") or ""
-    rep = state.get("reputation_score", 50)
-    itr = int(state.get("iteration", 0))
-    prev = "\n\n---\n".join(state.get("community_reactions", [])[-1:])
-
-    rubric = (
-        "Bewerte die Antwort des Unternehmens auf einer Skala 0-100 (0 sehr schlecht, 100 exzellent) "
-        "nach diesen Kriterien: (1) Verantwortungsübernahme, (2) Empathie, (3) Konkrete Maßnahmen/Abhilfe, "
-        "(4) Transparenz/Klarheit, (5) Ton (nicht defensiv, nicht relativierend). "
-        "Gib ein JSON mit Feldern: score (int), label ('poor'|'mixed'|'good'), "
-        "reasons (array kurzer Strings), suggestions (array kurzer Strings), "
-        "resolved (bool, wenn Antwort realistisch beruhigend), "
-        "catastrophe (bool, nur wenn Antwort die Lage massiv verschlimmert). "
-        "Keine zusätzlichen Texte außerhalb des JSON."
-    )
+def _eval_cache_get(key: bytes) -> Optional[Eval]:
+    data = _EVAL_CACHE.get(key)
+    if data is not None:
+        _EVAL_CACHE.move_to_end(key)
+    return data
 
-    prompt = f"""Anlass/Cause: {cause}
 
-Jüngste Community-Reaktionen:
-{prev if prev else "(keine)"}
+def _eval_cache_put(key: bytes, data: Eval) -> None:
+    _EVAL_CACHE[key] = data
+    _EVAL_CACHE.move_to_end(key)
+    if len(_EVAL_CACHE) > _EVAL_CACHE_MAXSIZE:
+        _EVAL_CACHE.popitem(last=False)
 
-Unternehmensantwort (zu bewerten):
-\"\"\"{reply}\"\"\"
 
-Wende die Rubrik an und antworte ausschließlich als JSON.
-"""
+async def _stream_round(prompt: str, rep: int, itr: int) -> Optional[RoundResult]:
+    # Streamen und die Statusfelder inkrementell mitparsen. Steht das Ende der
+    # Simulation fest, brechen wir ab, bevor reasons/suggestions/comments generiert werden.
+    buf = bytearray()
+    events = ijson.sendable_list()
+    parser = ijson.parse_coro(events)
+    seen: Dict = {}
 
-    raw = llm.invoke(
+    stream = round_llm.astream(
         [
-            {"role": "system", "content": rubric},
+            {"role": "system", "content": ROUND_SYS_PROMPT},
             {"role": "user", "content": prompt},
-        ],
-        # JSON-Modus (für OpenAI-Modelle unterstützt)
-        # Fällt automatisch zurück, falls nicht verfügbar.
-        # In vielen Setups funktioniert es ohne model_kwargs – daher minimal.
-    ).content
+        ]
+    )
+    try:
+        async for chunk in stream:
+            piece = chunk.content.encode()
+            buf += piece
+            if parser is None:
+                continue
+            try:
+                parser.send(piece)
+            except ijson.JSONError:
+                parser = None  # am Ende entscheidet der vollständige Decode
+                continue
+            for prefix, _event, value in events:
+                if prefix in _EARLY_FIELDS:
+                    seen[_EARLY_FIELDS[prefix]] = value
+            del events[:]
+            if len(seen) == len(_EARLY_FIELDS):
+                parser = None
+                try:
+                    partial = msgspec.convert(seen, Eval)  # gleiche Validierung wie beim vollen Decode
+                except msgspec.ValidationError:
+                    continue
+                if _outcome(rep, itr, partial.label, partial.resolved, partial.catastrophe)[1] != "ongoing":
+                    return RoundResult(eval=partial, partial=True)  # Simulation endet, keine Welle mehr nötig
+    finally:
+        # schließt auch die HTTP-Response beim vorzeitigen Abbruch
+        await stream.aclose()
 
     try:
-        data = json.loads(raw)
-    except Exception:
-        # Fallback: naive Reparatur
-        raw_fixed = raw.strip().split("```")[-1]
-        try:
-            data = json.loads(raw_fixed)
-        except Exception:
-            data = {
-                "score": 40, "label": "mixed",
-                "reasons": ["Konnte JSON nicht sauber parsen."],
-                "suggestions": ["Klarere Entschuldigung", "Konkrete Maßnahmen nennen"],
-                "resolved": False, "catastrophe": False
-            }
+        data = msgspec.json.decode(bytes(buf), type=RoundResult)
+    except msgspec.DecodeError:  # inkl. ValidationError; z.B. bei Refusal/abgeschnittener Antwort
+        return None
+    return data
 
-    score = int(data.get("score", 50))
-    label = str(data.get("label", "mixed"))
-    resolved = bool(data.get("resolved", False))
-    catastrophe = bool(data.get("catastrophe", False))
 
-    # sehr einfache Heuristik um reputation_score zu aktualisieren
-    delta = {"good": +20, "mixed": 0, "poor": -20}.get(label, 0)
-    new_rep = _clamp(rep + delta)
+async def combined_node(state: SimState, config: RunnableConfig) -> SimState:
+    header = _session_header(state["cause"])
+    rep = state.get("reputation_score", 50)
+    itr = int(state.get("iteration", 0))
+    prev = state.get("_prev_join_2", "")  # nur wenig Kontext, vorberechnet
+
+    # Erste Runde: noch keine Antwort zu bewerten, nur die erste Welle erzeugen
+    if state.get("company_response") is None:
+        wave = await _community_wave(header, _anger_from_rep(rep), None, prev)
+        return await _wave_update(state, config, wave)
+
+    reply = state["company_response"]
+
+    # Letzte Runde und selbst ein "good" hebt die Reputation nicht mehr auf 60: Spielregel,
+    # die Antwort wird nicht mehr bewertet und die Simulation endet als catastrophe.
+    # Achtung: Das ist kein reiner Spar-Pfad – mit Bewertung könnte ein resolved=True
+    # des Modells die Runde noch retten. Daher auch kein Score/Label im Ergebnis.
+    if itr >= 6 and rep + max(_LABEL_DELTA.values()) < 60:
+        return {
+            "last_eval": {
+                "score": None,
+                "label": None,
+                "reasons": ["Nicht bewertet: maximale Rundenzahl erreicht, Reputation zu niedrig."],
+            },
+            "reputation_score": rep,
+            "iteration": itr + 1,
+            "status": "catastrophe"
+        }
+
+    key = hashlib.sha1(f"{state['cause']}\0{reply}".encode()).digest()
+    data = _eval_cache_get(key)
+    wave = None
+    if data is None:
+        prompt = header + ROUND_USER_TMPL.format(
+            anger=_anger_from_rep(rep), prev=prev or "-", reply=reply or "-"
+        )
+        result = await _stream_round(prompt, rep, itr)
+        if result is not None:
+            data = result.eval
+            # Teilergebnisse waren nur für genau diese (rep, itr) terminal – nicht wiederverwenden
+            if not result.partial:
+                _eval_cache_put(key, data)
+            if result.comments:
+                wave = "\n".join(f"{i}. {c}" for i, c in enumerate(result.comments[:5], 1))
+        else:
+            data = Eval(
+                score=40, label="mixed",
+                reasons=["Konnte JSON nicht sauber parsen."],
+                suggestions=["Klarere Entschuldigung", "Konkrete Maßnahmen nennen"],
+            )
 
-    # Endbedingungen (simpel & transparent)
-    status: Literal["ongoing", "resolved", "catastrophe"] = "ongoing"
-    if resolved or new_rep >= 80:
-        status = "resolved"
-    elif catastrophe or new_rep <= 15 or itr >= 6 and new_rep < 60:
-        status = "catastrophe"
+    new_rep, status = _outcome(rep, itr, data.label, data.resolved, data.catastrophe)
 
     out = {
-        "last_eval": data,
+        "last_eval": msgspec.structs.asdict(data),
         "reputation_score": new_rep,
         "iteration": itr + 1,
         "status": status
     }
 
+    if status == "ongoing":
+        if wave is None:
+            # Bewertung aus dem Cache bzw. nicht parsebar: Welle separat erzeugen
+            wave = await _community_wave(header, _anger_from_rep(new_rep), reply, prev)
+        out.update(await _wave_update(state, config, wave))
+
     return out
 
 
+# -----------------------------------------
+# Node: Unternehmensantwort (mit interrupt)
+# -----------------------------------------
+
+def respond_node(state: SimState) -> SimState:
+    # Eigener Node ohne LLM-Aufruf: beim Resume läuft ein Node erneut von vorne,
+    # hier kostet das nichts.
+    # Der Wert von interrupt(...) wird beim Resume die User-Antwort enthalten.
+    company_reply = interrupt({
+        "type": "company_response_required",
+        "message": (
+            "Formuliere deine Unternehmensantwort (Tweet/Statement/Posting) "
+            "auf diese Kommentarwelle."
+        ),
+        "community_wave": state["community_reactions"][-1]
+    })
+    return {"company_response": company_reply}
+
+
 # ---------------------------------
 # Graph aufbauen (Nodes + Kanten)
 # ---------------------------------
 
-def build_app():
+# Checkpointer-Datei (lokale SQLite-Datei)
+CHECKPOINT_DB = "shitstorm_sim.sqlite"
+
+
+_APP = None
+_APP_LOCK: Optional[asyncio.Lock] = None
+
+
+async def _open_checkpointer() -> AsyncSqliteSaver:
+    # Eine Verbindung für die gesamte Laufzeit, geschlossen über close_app()
+    conn = await aiosqlite.connect(CHECKPOINT_DB)
+    # Standard-Serde (JsonPlus) schreibt bereits msgpack über ormsgpack – kein eigener Serializer nötig
+    return AsyncSqliteSaver(conn)
+
+
+async def _tune_checkpointer(memory: AsyncSqliteSaver) -> AsyncSqliteSaver:
+    # WAL + synchronous=NORMAL: kein fsync mehr pro Checkpoint-Commit (nur beim WAL-Checkpoint)
+    await memory.conn.executescript(
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        "PRAGMA busy_timeout=5000;"
+        "PRAGMA temp_store=MEMORY;"
+        "PRAGMA cache_size=-20000;"
+    )
+    return memory
+
+
+async def build_app():
+    # Graph + Checkpointer nur einmal bauen – alle Simulationen im Event-Loop teilen sich die App
+    global _APP_LOCK
+    if _APP_LOCK is None:
+        _APP_LOCK = asyncio.Lock()
+    async with _APP_LOCK:
+        if _APP is None:
+            await _build_app()
+    return _APP
+
+
+async def _build_app():
+    global _APP
     builder = StateGraph(SimState)
 
-    builder.add_node("react", community_reaction_node)
-    builder.add_node("evaluate", evaluation_node)
+    builder.add_node("combined", combined_node)
+    builder.add_node("respond", respond_node)
 
-    builder.add_edge(START, "react")
-    builder.add_edge("react", "evaluate")
+    builder.add_edge(START, "combined")
 
     def continue_or_end(state: SimState):
         if state.get("status") in ("resolved", "catastrophe"):
             return END
-        return "react"
+        return "respond"
 
-    builder.add_conditional_edges("evaluate", continue_or_end)
+    builder.add_conditional_edges("combined", continue_or_end)
+    builder.add_edge("respond", "combined")
 
-    # Checkpointer für Interrupt/Resume (lokale SQLite-Datei)
-    memory = SqliteSaver.from_conn_string("shitstorm_sim.sqlite")
-    return builder.compile(checkpointer=memory)
+    # LLMs zuerst: scheitern sie (z.B. fehlender API-Key), ist noch keine DB-Verbindung offen
+    _open_llms()
+
+    # Checkpointer für Interrupt/Resume
+    memory = await _open_checkpointer()
+    try:
+        await _tune_checkpointer(memory)
+        _APP = builder.compile(checkpointer=memory)
+    except BaseException:
+        # close_app() erreicht die Verbindung nur über _APP – hier selbst schließen,
+        # sonst hält der aiosqlite-Thread den Prozess am Leben
+        await memory.conn.close()
+        raise
+
+
+async def close_app():
+    # Einmal beim Beenden aufrufen (siehe run_cli), nicht pro Simulation.
+    # aiosqlite hält einen eigenen Thread offen – ohne close() beendet sich der Prozess nicht
+    global _APP, _APP_LOCK, _HTTP_CLIENT
+    if _APP is not None:
+        await _APP.checkpointer.conn.close()
+        _APP = None
+    if _HTTP_CLIENT is not None:
+        await _HTTP_CLIENT.aclose()
+        _HTTP_CLIENT = None
+    _APP_LOCK = None
 
 
 # ---------------------------------
 # Mini-CLI Runner (einfach gehalten)
 # ---------------------------------
 
-def run_cli():
+async def _warmup():
+    # Verbindung (TLS + HTTP/2) im gemeinsamen Client aufbauen, während der User tippt.
+    # models.list() kostet keine Tokens.
+    try:
+        await reaction_llm.root_async_client.models.list()
+    except Exception:
+        pass  # nur Optimierung – Fehler zeigen sich beim ersten echten Aufruf
+
+
+async def amain():
     print("\n=== Shitstorm Simulation (LangGraph Minimal) ===\n")
-    cause = input("Ursache/Anlass des Shitstorms (kurz beschreiben): ").strip()
+    app = await build_app()
+    warmup = asyncio.create_task(_warmup())
+    # input() blockiert – im Thread ausführen, damit der Event-Loop frei bleibt
+    cause = (await asyncio.to_thread(input, "Ursache/Anlass des Shitstorms (kurz beschreiben): ")).strip()
     if not cause:
+        warmup.cancel()
         print("Abbruch: Keine Ursache angegeben.")
         sys.exit(0)
 
-    app = build_app()
+    await _simulate(app, cause)
+
 
+async def _simulate(app, cause: str):
     # Jede Simulation bekommt eine thread_id (damit Resume sauber funktioniert)
     thread_id = str(uuid.uuid4())
 
@@ -242,73 +527,80 @@ def run_cli():
         "status": "ongoing",
     }
 
-    # Erste Ausführung: streamen, Interrupt abfangen, dann resume
-    config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": "main"}}
+    config = {"configurable": {"thread_id": thread_id}}
 
     # Einfache Event-Schleife: Wir streamen, prüfen auf Interrupts, fragen nach Antwort und resumen
-    current_state = initial_state
+    payload = initial_state
+    shown_round = 0
 
     while True:
         # 1) Stream bis zum nächsten Interrupt / Ende
         interrupted = None
-        checkpoint_id = None
 
-        for event in app.stream(current_state, stream_mode="values", config=config):
+        async for event in app.astream(payload, stream_mode="values", config=config):
             # Wenn ein Interrupt passiert, enthält das Event ein __interrupt__-Feld
-            if isinstance(event, dict) and "__interrupt__" in event:
-                interrupted = event["__interrupt__"]  # Liste von Interrupts
-                checkpoint_id = event.get("checkpoint_id")
+            if "__interrupt__" in event:
+                interrupted = event["__interrupt__"]  # Tupel von Interrupts
                 break
 
-            # Ausgabe nach Evaluierung (wenn vorhanden)
-            if isinstance(event, dict):
-                # Wenn gerade eine Evaluierung gelaufen ist, gib ein kurzes Feedback
-                st = event
-                if st.get("last_eval"):
-                    le = st["last_eval"]
-                    print("\n--- Bewertung (automatisch) ---")
-                    print(f"Score: {le.get('score')} | Label: {le.get('label')}")
-                    if le.get("reasons"):
-                        print("Gründe:", "; ".join(le["reasons"]))
-                    if le.get("suggestions"):
-                        print("Vorschläge:", "; ".join(le["suggestions"]))
-                    print(f"Reputation: {st.get('reputation_score')} | Runde: {st.get('iteration')} | Status: {st.get('status')}")
-                    # Wenn beendet, Abschluss ausgeben und return
-                    if st.get("status") == "resolved":
-                        print("\n✅ Die Lage beruhigt sich. Shitstorm weitgehend abgeklungen.")
-                        return
-                    if st.get("status") == "catastrophe":
-                        print("\n❌ Reputation stark beschädigt. Shitstorm eskaliert.")
-                        return
-
-        # 2) Falls interrupt: Community-Welle anzeigen, Unternehmensantwort abfragen, resume
-        if interrupted:
-            # Wir erwarten genau einen Interrupt pro Runde
-            intr = interrupted[0]
-            wave = intr.get("community_wave")
-            if wave:
-                print("\n=== Neue Community-Welle ===")
-                print(wave)
-
-            answer = input("\nDeine Unternehmensantwort: ").strip()
-            if not answer:
-                print("Hinweis: Leere Antwort eingegeben. (Das wird schlecht bewertet werden.)")
-
-            # 3) Resume: Antwort an LangGraph übergeben, dann geht's weiter zur Evaluation
-            if checkpoint_id is None:
-                # Fallback, sollte nicht passieren – aber dann streamen wir einfach neu
-                current_state["company_response"] = answer
-                continue
-            else:
-                for event in app.resume([answer], checkpoint_id=checkpoint_id, stream_mode="values", config=config):
-                    if isinstance(event, dict):
-                        # Zustand auffrischen
-                        current_state.update(event)
-                # Danach läuft die Schleife erneut (Evaluation/Ende wird in der nächsten Iteration ausgegeben)
-        else:
+            # Ausgabe nach Evaluierung (einmal pro Runde – "values" liefert den ganzen State)
+            st = event
+            if st.get("last_eval") and st.get("iteration", 0) > shown_round:
+                shown_round = st["iteration"]
+                le = st["last_eval"]
+                # Ausgabe sammeln und mit einem write() + flush() pro Event schreiben
+                lines = [
+                    "\n--- Bewertung (automatisch) ---",
+                    f"Score: {le.get('score')} | Label: {le.get('label')}"
+                    if le.get("score") is not None else "Score: - | Label: - (nicht bewertet)",
+                ]
+                if le.get("reasons"):
+                    lines.append("Gründe: " + "; ".join(le["reasons"]))
+                if le.get("suggestions"):
+                    lines.append("Vorschläge: " + "; ".join(le["suggestions"]))
+                lines.append(f"Reputation: {st.get('reputation_score')} | Runde: {st.get('iteration')} | Status: {st.get('status')}")
+                # Wenn beendet, Abschluss mit ausgeben und return
+                if st.get("status") == "resolved":
+                    lines.append("\n✅ Die Lage beruhigt sich. Shitstorm weitgehend abgeklungen.")
+                elif st.get("status") == "catastrophe":
+                    lines.append("\n❌ Reputation stark beschädigt. Shitstorm eskaliert.")
+                sys.stdout.write("\n".join(lines) + "\n")
+                sys.stdout.flush()
+                if st.get("status") in ("resolved", "catastrophe"):
+                    return
+
+        if not interrupted:
             # Kein Interrupt => Graph ist zu Ende gelaufen
             break
 
+        # 2) Interrupt: Community-Welle anzeigen, Unternehmensantwort abfragen
+        # Wir erwarten genau einen Interrupt pro Runde
+        intr = interrupted[0].value
+        wave = intr.get("community_wave")
+        if wave:
+            sys.stdout.write(f"\n=== Neue Community-Welle ===\n{wave}\n")
+            sys.stdout.flush()
+
+        answer = (await asyncio.to_thread(input, "\nDeine Unternehmensantwort: ")).strip()
+        if not answer:
+            print("Hinweis: Leere Antwort eingegeben. (Das wird schlecht bewertet werden.)")
+
+        # 3) Resume: Antwort an LangGraph übergeben, dann geht's weiter zur Evaluation
+        payload = Command(resume=answer)
+
+
+async def _run_and_close():
+    try:
+        await amain()
+    finally:
+        # Die App gehört zum Event-Loop (aiosqlite, Locks) und wird genau einmal
+        # an dessen Ende geschlossen
+        await close_app()
+
+
+def run_cli():
+    asyncio.run(_run_and_close())
+
 # neu rauf
 # ---------------------------
 # Main